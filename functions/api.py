@@ -1,4 +1,6 @@
 from mangum import Mangum
+from contextlib import AsyncExitStack
+import asyncio
 import sys
 import os
 
@@ -8,5 +10,14 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Import the FastAPI app
 from main import app
 
-# Create the handler for AWS Lambda
-handler = Mangum(app) 
\ No newline at end of file
+# Run the app lifespan once during Lambda init, which is not billed, so the
+# shared HTTP client and Redis connection are open before the first
+# invocation. Mangum runs every invocation on this same event loop.
+_loop = asyncio.new_event_loop()
+asyncio.set_event_loop(_loop)
+_lifespan = AsyncExitStack()
+_loop.run_until_complete(_lifespan.enter_async_context(app.router.lifespan_context(app)))
+
+# Create the handler for AWS Lambda. Mangum would otherwise start and stop the
+# lifespan around every invocation, discarding the pooled connections.
+handler = Mangum(app, lifespan="off")
\ No newline at end of file
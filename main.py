@@ -1,13 +1,20 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import AsyncIterator, List, Dict, Any, Optional, Union
+from typing_extensions import TypedDict
+import asyncio
 import logging
 import os
+import time
+import orjson
+import aiohttp
+from redis.asyncio import Redis
 from datetime import datetime
 from dotenv import load_dotenv
-from search_service import BraveSearchService
+from search_service import BraveSearchService, query_rejection_reason
 
 # Load environment variables
 load_dotenv()
@@ -19,11 +26,59 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Initialize search service
+try:
+    search_service = BraveSearchService()
+    logger.info("Search service initialized successfully")
+except Exception as e:
+    logger.error("Failed to initialize search service: %s", e)
+    raise
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared HTTP client (and Redis cache, if configured) for the app's lifetime."""
+    client = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=30),
+        headers=search_service.headers
+    )
+    app.state.http_client = client
+    search_service.client = client
+    logger.info("Shared HTTP client initialized")
+
+    redis = None
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        # Short timeouts so an unreachable Redis fails fast into the per-process fallbacks
+        redis = Redis.from_url(
+            redis_url,
+            decode_responses=False,
+            socket_connect_timeout=1.0,
+            socket_timeout=0.5
+        )
+        app.state.redis = redis
+        search_service.use_redis(redis)
+        logger.info("Redis response cache and rate limiter enabled")
+
+    await search_service.warm_up()
+
+    try:
+        yield
+    finally:
+        search_service.client = None
+        search_service.use_redis(None)
+        await client.close()
+        if redis is not None:
+            await redis.aclose()
+        logger.info("Shared HTTP client closed")
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Search API",
     description="A search engine API powered by Brave Search",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -35,22 +90,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize search service
-try:
-    search_service = BraveSearchService()
-    logger.info("Search service initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize search service: {str(e)}")
-    raise
-
-# Pydantic models
+# Request and error models (validated by Pydantic)
 class SearchQuery(BaseModel):
+    # Strip the query during validation; requests are read-only once parsed
+    model_config = ConfigDict(str_strip_whitespace=True, extra='ignore', frozen=True)
+
     query: str
     page: int = Field(default=1, ge=1)
     per_page: int = Field(default=10, ge=1, le=50)
     filters: Optional[Dict[str, Any]] = None
 
-class SearchResult(BaseModel):
+class BatchSearchQuery(BaseModel):
+    queries: List[SearchQuery] = Field(..., min_length=1, max_length=20)
+
+class ErrorResponse(BaseModel):
+    error: str
+    message: str
+    detail: Optional[Dict[str, Any]] = None
+
+# Response schemas. These are TypedDicts so they document the OpenAPI schema
+# without a validation pass over data the service already builds in this shape.
+class SearchResult(TypedDict):
     url: str
     title: str
     snippet: str
@@ -60,25 +120,42 @@ class SearchResult(BaseModel):
     metadata: Dict[str, Any]
     last_updated: str
 
-class SearchResponse(BaseModel):
+class SearchResponse(TypedDict):
     results: List[SearchResult]
     total: int
     page: int
     per_page: int
     total_pages: int
 
-class SuggestionsResponse(BaseModel):
+class SuggestionsResponse(TypedDict):
     suggestions: List[str]
 
-class ErrorResponse(BaseModel):
-    error: str
-    message: str
-    detail: Optional[Dict[str, Any]] = None
+class BatchSearchResponse(TypedDict):
+    results: List[Union[SearchResponse, ErrorResponse]]
+
+# Upper bound on concurrent upstream searches for a single batch request
+BATCH_SEARCH_CONCURRENCY = 5
+
+# Search pages larger than this are serialized in chunks, one result at a time,
+# instead of as a single body. The results themselves are already in memory, and
+# Mangum buffers the stream on Lambda.
+STREAMING_PAGE_THRESHOLD = 20
+
+async def _iter_search_response(results: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """Serialize a search response one result at a time."""
+    yield b'{"results":['
+    for index, result in enumerate(results["results"]):
+        if index:
+            yield b","
+        yield orjson.dumps(result)
+    # Remaining fields: reuse their serialized object without its opening brace
+    rest = {key: value for key, value in results.items() if key != "results"}
+    yield b"]," + orjson.dumps(rest)[1:]
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Global exception handler for all unhandled exceptions."""
-    logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
+    logger.error("Unhandled exception: %s", exc, exc_info=True)
     return JSONResponse(
         status_code=500,
         content={
@@ -88,34 +165,52 @@ async def global_exception_handler(request: Request, exc: Exception):
         }
     )
 
+# The root payload never changes, so serialize it once
+_ROOT_BODY = orjson.dumps({
+    "name": "Search API",
+    "version": "1.0.0",
+    "description": "A search engine API powered by Brave Search",
+    "status": "operational",
+    "endpoints": {
+        "/search": "Search for documents",
+        "/search/batch": "Run several searches in one request",
+        "/suggest": "Get search suggestions",
+        "/health": "Check API health",
+        "/health/deep": "Check API health against Brave Search, bypassing the cached result"
+    }
+})
+
+# A successful upstream probe is trusted for this many seconds, so frequent
+# load balancer probes do not spend the Brave rate limit
+HEALTH_CHECK_TTL = 30.0
+_last_healthy_at = float("-inf")
+_last_healthy_timestamp = ""
+
 @app.get("/")
 async def root():
     """Root endpoint with API information."""
-    return {
-        "name": "Search API",
-        "version": "1.0.0",
-        "description": "A search engine API powered by Brave Search",
-        "status": "operational",
-        "endpoints": {
-            "/search": "Search for documents",
-            "/suggest": "Get search suggestions",
-            "/health": "Check API health"
-        }
-    }
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint."""
+async def _check_health(force: bool) -> Dict[str, Any]:
+    """Probe the search service unless a recent probe succeeded (or `force` is set)."""
+    global _last_healthy_at, _last_healthy_timestamp
+    cached = not force and time.monotonic() - _last_healthy_at < HEALTH_CHECK_TTL
     try:
-        # Test the search service with a simple query
-        await search_service.search("test", page=1, per_page=1)
+        if not cached:
+            # Test the search service with a simple query
+            await search_service.search("test", page=1, per_page=1, use_cache=False)
+            _last_healthy_at = time.monotonic()
+            # Wall-clock time is only formatted when the probe actually runs
+            _last_healthy_timestamp = datetime.utcnow().isoformat()
         return {
             "status": "healthy",
             "search_service": "connected",
-            "timestamp": datetime.utcnow().isoformat()
+            "cached": cached,
+            "timestamp": _last_healthy_timestamp
         }
     except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
+        _last_healthy_at = float("-inf")
+        logger.error("Health check failed: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -125,18 +220,33 @@ async def health_check():
             }
         )
 
-@app.post("/search", response_model=SearchResponse, responses={500: {"model": ErrorResponse}})
+@app.get("/health")
+async def health_check():
+    """Health check endpoint; reuses a successful probe for HEALTH_CHECK_TTL seconds."""
+    return await _check_health(force=False)
+
+@app.get("/health/deep")
+async def deep_health_check():
+    """Health check endpoint that always probes Brave Search."""
+    return await _check_health(force=True)
+
+@app.post(
+    "/search",
+    response_class=ORJSONResponse,
+    responses={200: {"model": SearchResponse}, 500: {"model": ErrorResponse}}
+)
 async def search(query: SearchQuery):
     """Search endpoint using Brave Search API."""
     try:
-        logger.info(f"Received search request: {query.query} (page {query.page})")
+        logger.info("Received search request: %s (page %d)", query.query, query.page)
         
-        if not query.query.strip():
+        rejection = query_rejection_reason(query.query)
+        if rejection:
             raise HTTPException(
                 status_code=400,
                 detail={
                     "error": "Invalid query",
-                    "message": "Search query cannot be empty"
+                    "message": rejection
                 }
             )
 
@@ -147,13 +257,16 @@ async def search(query: SearchQuery):
             filters=query.filters
         )
         
-        logger.info(f"Search successful: found {results['total']} results")
-        return SearchResponse(**results)
+        logger.info("Search successful: found %s results", results["total"])
+        # Already shaped like SearchResponse; serialize directly without re-validating
+        if query.per_page > STREAMING_PAGE_THRESHOLD:
+            return StreamingResponse(_iter_search_response(results), media_type="application/json")
+        return ORJSONResponse(results)
     except HTTPException:
         raise
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Search error: {error_msg}")
+        logger.error("Search error: %s", error_msg)
         raise HTTPException(
             status_code=500,
             detail={
@@ -163,14 +276,60 @@ async def search(query: SearchQuery):
             }
         )
 
-@app.get("/suggest", response_model=SuggestionsResponse, responses={500: {"model": ErrorResponse}})
+@app.post(
+    "/search/batch",
+    response_class=ORJSONResponse,
+    responses={200: {"model": BatchSearchResponse}}
+)
+async def search_batch(batch: BatchSearchQuery):
+    """Run several searches concurrently; results are returned in request order."""
+    logger.info("Received batch search request with %d queries", len(batch.queries))
+    semaphore = asyncio.Semaphore(BATCH_SEARCH_CONCURRENCY)
+
+    async def run_one(query: SearchQuery) -> Dict[str, Any]:
+        rejection = query_rejection_reason(query.query)
+        if rejection:
+            # The caller's own bad input, reported like /search's 400 rather than as an upstream failure
+            return {
+                "error": "Invalid query",
+                "message": rejection,
+                "detail": {"query": query.query}
+            }
+        async with semaphore:
+            return await search_service.search(
+                query.query,
+                page=query.page,
+                per_page=query.per_page,
+                filters=query.filters
+            )
+
+    outcomes = await asyncio.gather(*(run_one(q) for q in batch.queries), return_exceptions=True)
+
+    results = []
+    for query, outcome in zip(batch.queries, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error("Batch search error for '%s': %s", query.query, outcome)
+            results.append({
+                "error": "Search failed",
+                "message": str(outcome),
+                "detail": {"query": query.query}
+            })
+        else:
+            results.append(outcome)
+    return ORJSONResponse({"results": results})
+
+@app.get(
+    "/suggest",
+    response_class=ORJSONResponse,
+    responses={200: {"model": SuggestionsResponse}, 500: {"model": ErrorResponse}}
+)
 async def get_suggestions(q: str = Query(..., min_length=2)):
     """Get search suggestions from Brave Search API."""
     try:
         suggestions = await search_service.get_suggestions(q)
-        return SuggestionsResponse(suggestions=suggestions)
+        return ORJSONResponse(SuggestionsResponse(suggestions=suggestions))
     except Exception as e:
-        logger.error(f"Suggestions error: {str(e)}")
+        logger.error("Suggestions error: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -182,10 +341,16 @@ async def get_suggestions(q: str = Query(..., min_length=2)):
 
 if __name__ == "__main__":
     import uvicorn
+    workers = int(os.getenv('WORKERS', 1))
     uvicorn.run(
         "main:app",
         host=os.getenv('HOST', '127.0.0.1'),
         port=int(os.getenv('PORT', 8000)),
-        reload=True,
+        # uvicorn cannot reload with multiple workers
+        reload=workers == 1,
+        workers=workers,
+        # "auto" picks uvloop where it is installed (every non-Windows platform per requirements.txt)
+        loop="auto",
+        http="httptools",
         log_level="info"
     )
\ No newline at end of file
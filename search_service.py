@@ -1,10 +1,21 @@
 import os
-import httpx
+import re
+import random
+import copy
+import hashlib
+import aiohttp
+import orjson
 import asyncio
-from typing import Dict, List, Optional, Any
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Any
+from urllib.parse import urlsplit as _urlsplit
+from cachetools import TTLCache
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 from dotenv import load_dotenv
 import logging
-from datetime import datetime, timedelta
 
 # Load environment variables
 load_dotenv()
@@ -14,26 +25,182 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class RateLimiter:
-    def __init__(self, requests_per_second: float = 0.8):  # Slightly less than 1 to be safe
-        self.requests_per_second = requests_per_second
-        self.min_interval = 1.0 / requests_per_second
-        self.last_request_time = datetime.min
+    """Token bucket: refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, capacity: int = 1, rate: float = 0.8):  # Slightly less than 1 to be safe
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens: float = float(capacity)
+        self.last_refill: float = time.monotonic()
         self._lock = asyncio.Lock()
 
     async def acquire(self):
-        async with self._lock:
-            now = datetime.now()
-            time_since_last_request = (now - self.last_request_time).total_seconds()
-            
-            if time_since_last_request < self.min_interval:
-                wait_time = self.min_interval - time_since_last_request
-                logger.info(f"Rate limit: waiting {wait_time:.2f} seconds")
-                await asyncio.sleep(wait_time)
-            
-            self.last_request_time = datetime.now()
+        # Only the bookkeeping happens under the lock; waiting happens outside
+        # it so other callers are not serialized behind a sleeper.
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                elapsed = now - self.last_refill
+                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+
+            logger.info("Rate limit: waiting %.2f seconds", wait_time)
+            await asyncio.sleep(wait_time)
+
+    async def pause(self, seconds: float):
+        """Withhold tokens so the next request is admitted no sooner than `seconds` from now."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+# Atomic token bucket update. ARGV: capacity, rate (tokens/s), pause seconds.
+# With pause > 0 the bucket is drained so the next token is `pause` seconds
+# away; otherwise one token is taken. Returns the milliseconds to wait before
+# retrying, or 0 once a token was taken (or the pause applied).
+_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local pause = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'last_refill_ms')
+local tokens = tonumber(state[1]) or capacity
+local last = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate / 1000)
+local wait = 0
+if pause > 0 then
+    tokens = math.min(tokens, 1 - pause * rate)
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last_refill_ms', now)
+-- Keep the state until the bucket has refilled, so long pauses are not dropped
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 60000)
+return wait
+"""
+
+class RedisRateLimiter:
+    """
+    Token bucket kept in Redis, so the Brave quota is shared by every process
+    and Lambda container. Falls back to a local limiter if Redis is unavailable.
+    """
+
+    def __init__(self, redis: Redis, fallback: RateLimiter, key: str = "brave:bucket"):
+        self.capacity = fallback.capacity
+        self.rate = fallback.rate
+        self.key = key
+        self._fallback = fallback
+        self._script = redis.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    async def _run(self, pause: float) -> int:
+        return int(await self._script(keys=[self.key], args=[self.capacity, self.rate, pause]))
+
+    async def acquire(self):
+        while True:
+            try:
+                wait_ms = await self._run(0)
+            except RedisError as e:
+                logger.warning("Shared rate limiter unavailable, using local limiter: %s", e)
+                await self._fallback.acquire()
+                return
+            if not wait_ms:
+                return
+
+            logger.info("Rate limit: waiting %.2f seconds", wait_ms / 1000)
+            await asyncio.sleep(wait_ms / 1000)
+
+    async def pause(self, seconds: float):
+        """Withhold tokens so the next request is admitted no sooner than `seconds` from now."""
+        try:
+            await self._run(seconds)
+        except RedisError as e:
+            logger.warning("Shared rate limiter unavailable, pausing local limiter: %s", e)
+            await self._fallback.pause(seconds)
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def _first_header_number(value: Optional[str]) -> Optional[float]:
+    """
+    Read the first number of a rate limit header. Brave sends one value per
+    window, shortest first (e.g. "1, 15000"), so this is the per-second window.
+    """
+    if not value:
+        return None
+    try:
+        return float(value.split(",", 1)[0])
+    except ValueError:
+        return None
+
+# Optional pattern for queries to refuse before they cost a rate limiter token.
+# Queries are only forwarded to Brave, so nothing is denied unless this is set.
+_denylist_pattern = os.getenv("QUERY_DENYLIST_PATTERN", "").strip()
+QUERY_DENYLIST = re.compile(_denylist_pattern, re.IGNORECASE) if _denylist_pattern else None
+
+def query_rejection_reason(query: str, min_length: int = 1) -> Optional[str]:
+    """Cheap structural check run before any upstream call; returns why `query` is refused, or None."""
+    query = query.strip()
+    if not query:
+        return "Search query cannot be empty"
+    if len(query) < min_length:
+        return f"Search query must be at least {min_length} characters"
+    if not any(c.isalnum() for c in query):
+        return "Search query must contain letters or digits"
+    if QUERY_DENYLIST is not None and QUERY_DENYLIST.search(query):
+        return "Search query is not allowed"
+    return None
+
+def is_valid_query(query: str, min_length: int = 1) -> bool:
+    """Return True if `query` passes query_rejection_reason()."""
+    return query_rejection_reason(query, min_length) is None
+
+def _transform_result(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a Brave web result onto our application's result format."""
+    get = item.get
+    url = get("url") or ""
+    published_date = get("published_date")
+    return {
+        "url": url,
+        "title": get("title"),
+        "snippet": get("description"),
+        "score": get("score", 0),
+        "domain": _urlsplit(url).netloc,
+        "language": get("language", "en"),
+        "metadata": {
+            "published_date": published_date,
+            "age": get("age"),
+            "type": get("type", "web")
+        },
+        "last_updated": published_date or ""
+    }
+
+SEARCH_CACHE_TTL = 300
+SUGGEST_CACHE_TTL = 60
+# A cached shorter prefix is reused only if it still yields this many matches
+SUGGEST_PREFIX_MIN_MATCHES = 5
 
 class BraveSearchService:
-    def __init__(self):
+    def __init__(self, client: Optional[aiohttp.ClientSession] = None, redis: Optional[Redis] = None):
         self.api_key = os.getenv("BRAVE_SEARCH_API_KEY")
         if not self.api_key:
             raise ValueError("BRAVE_SEARCH_API_KEY not found in environment variables")
@@ -45,47 +212,159 @@ class BraveSearchService:
             "Accept": "application/json",
             "X-Subscription-Token": self.api_key
         }
-        self.rate_limiter = RateLimiter()
+        # Shared, pooled client; normally attached by the app lifespan
+        self.client = client
+        self._local_rate_limiter = RateLimiter(
+            capacity=int(os.getenv("BRAVE_RATE_LIMIT_BURST", 1)),
+            rate=float(os.getenv("BRAVE_RATE_LIMIT_RPS", 0.8))
+        )
         self.max_retries = 3
         self.retry_delay = 1.0  # Initial retry delay in seconds
+        self.max_retry_delay = 10.0
+
+        # Response caches. Redis, when attached, is shared by every instance;
+        # otherwise fall back to per-process caches. Those reads and writes
+        # never await, so they are safe on the event loop without a lock.
+        self.use_redis(redis)
+        self._search_cache = TTLCache(maxsize=10_000, ttl=SEARCH_CACHE_TTL)
+        self._suggest_cache = TTLCache(maxsize=50_000, ttl=SUGGEST_CACHE_TTL)
+
+        # Upstream fetches currently running, keyed on the canonical request
+        self._inflight: Dict[bytes, asyncio.Task] = {}
+
+    async def _single_flight(self, key: bytes, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `fetch` once for concurrent callers sharing `key`; they all receive its result.
+        The fetch runs as its own task so a cancelled caller does not cancel it for the rest.
+        Joining callers get a deep copy, matching the cache's no-shared-state guarantee.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+
+            def _done(finished: asyncio.Task):
+                self._inflight.pop(key, None)
+                # Mark the exception as retrieved if every caller has gone away
+                if not finished.cancelled():
+                    finished.exception()
+
+            task.add_done_callback(_done)
+            return await asyncio.shield(task)
+
+        logger.info("Joining in-flight upstream request")
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def use_redis(self, redis: Optional[Redis]):
+        """Share the response cache and rate limit through `redis`, or keep them per process if None."""
+        self.redis = redis
+        if redis is None:
+            self.rate_limiter = self._local_rate_limiter
+        else:
+            self.rate_limiter = RedisRateLimiter(redis, fallback=self._local_rate_limiter)
+
+    async def warm_up(self):
+        """Open the upstream TLS connection (and Redis connection) before the first request needs them."""
+        if self.client is not None:
+            try:
+                async with self.client.head("https://api.search.brave.com/", timeout=aiohttp.ClientTimeout(total=5)):
+                    pass
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("Upstream warm-up failed: %s", e)
+        if self.redis is not None:
+            try:
+                await self.redis.ping()
+            except RedisError as e:
+                logger.warning("Redis warm-up failed: %s", e)
+
+    async def _cache_get(self, namespace: bytes, key: bytes, local_cache: TTLCache) -> Any:
+        """Look up a cached response, returning None on a miss."""
+        if self.redis is None:
+            cached = local_cache.get(key)
+            return copy.deepcopy(cached) if cached is not None else None
+
+        try:
+            cached = await self.redis.get(namespace + key)
+        except RedisError as e:
+            logger.warning("Cache read failed, falling back to upstream: %s", e)
+            return None
+        return orjson.loads(cached) if cached is not None else None
+
+    async def _cache_set(self, namespace: bytes, key: bytes, value: Any, local_cache: TTLCache, ttl: int):
+        """Store a response in the cache; failures are logged and ignored."""
+        if self.redis is None:
+            local_cache[key] = copy.deepcopy(value)
+            return
+
+        try:
+            await self.redis.set(namespace + key, orjson.dumps(value), ex=ttl)
+        except RedisError as e:
+            logger.warning("Cache write failed: %s", e)
+
+    @staticmethod
+    def _search_request_key(
+        query: str,
+        page: int,
+        per_page: int,
+        filters: Optional[Dict[str, Any]]
+    ) -> bytes:
+        """Return a digest identifying a search request."""
+        canonical = orjson.dumps([query, page, per_page, filters], option=orjson.OPT_SORT_KEYS, default=str)
+        return hashlib.blake2b(canonical).digest()
+
+    def _next_backoff(self, previous: float) -> float:
+        """Exponential backoff with decorrelated jitter, so failing clients do not retry in lockstep."""
+        return min(self.max_retry_delay, random.uniform(self.retry_delay, previous * 3))
+
+    async def _observe_rate_limit_headers(self, headers: Any):
+        """Pause the rate limiter when Brave reports the current window is used up."""
+        remaining = _first_header_number(headers.get("X-RateLimit-Remaining"))
+        if remaining is None or remaining > 0:
+            return
+        reset = _first_header_number(headers.get("X-RateLimit-Reset") or headers.get("RateLimit-Reset"))
+        if reset:
+            await self.rate_limiter.pause(reset)
 
-    async def _make_request(self, client: httpx.AsyncClient, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    async def _make_request(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """Make a request with retry logic and rate limiting."""
+        if self.client is None:
+            raise RuntimeError("HTTP client is not initialized; start the app lifespan first")
+
+        backoff = self.retry_delay
         for attempt in range(self.max_retries):
+            last_attempt = attempt == self.max_retries - 1
             try:
                 await self.rate_limiter.acquire()
                 
-                response = await client.get(
-                    url,
-                    headers=self.headers,
-                    params=params,
-                    timeout=30.0
-                )
-                
-                # Log the response status and headers for debugging
-                logger.info(f"Response status: {response.status_code}")
-                
-                if response.status_code == 429:  # Rate limit exceeded
-                    retry_after = int(response.headers.get('Retry-After', self.retry_delay))
-                    logger.warning(f"Rate limit exceeded. Waiting {retry_after} seconds before retry.")
-                    await asyncio.sleep(retry_after)
-                    continue
-                
-                response.raise_for_status()
-                return response.json()
+                async with self.client.get(url, params=params) as response:
+                    # Log the response status and headers for debugging
+                    logger.info("Response status: %d", response.status)
+                    await self._observe_rate_limit_headers(response.headers)
+                    
+                    if response.status == 429 and not last_attempt:  # Rate limit exceeded
+                        backoff = self._next_backoff(backoff)
+                        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                        wait_time = retry_after if retry_after is not None else backoff
+                        # Hold back every caller, not just this one, until the window reopens
+                        await self.rate_limiter.pause(wait_time)
+                        if wait_time > self.max_retry_delay:
+                            # Too long to hold this request open; fail it now with the 429
+                            logger.warning("Rate limit exceeded. Retry-After of %.2f seconds is too long to wait.", wait_time)
+                            response.raise_for_status()
+                        logger.warning("Rate limit exceeded. Waiting %.2f seconds before retry.", wait_time)
+                        continue
+                    
+                    response.raise_for_status()
+                    # Parse the raw body; response.json() would decode it to str first
+                    return orjson.loads(await response.read())
                 
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 429 and attempt < self.max_retries - 1:
-                    retry_after = int(e.response.headers.get('Retry-After', self.retry_delay * (attempt + 1)))
-                    logger.warning(f"Rate limit exceeded. Waiting {retry_after} seconds before retry.")
-                    await asyncio.sleep(retry_after)
-                    continue
+            except aiohttp.ClientResponseError:
                 raise
             except Exception as e:
-                if attempt < self.max_retries - 1:
-                    wait_time = self.retry_delay * (attempt + 1)
-                    logger.warning(f"Request failed. Retrying in {wait_time} seconds. Error: {str(e)}")
-                    await asyncio.sleep(wait_time)
+                if not last_attempt:
+                    backoff = self._next_backoff(backoff)
+                    logger.warning("Request failed. Retrying in %.2f seconds. Error: %s", backoff, e)
+                    await asyncio.sleep(backoff)
                     continue
                 raise
 
@@ -94,69 +373,32 @@ class BraveSearchService:
         query: str,
         page: int = 1,
         per_page: int = 10,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True
     ) -> Dict[str, Any]:
         """
         Perform a search using Brave Search API with rate limiting and retry logic.
+        Identical searches are served from a short-lived cache unless `use_cache` is False.
         """
+        if not is_valid_query(query):
+            logger.info("Rejected invalid search query: %r", query)
+            return {"results": [], "total": 0, "page": page, "per_page": per_page, "total_pages": 0}
+
+        request_key = self._search_request_key(query, page, per_page, filters)
+        # Date-bounded searches are time sensitive, so always go upstream
+        cacheable = use_cache and not (filters and (filters.get("min_date") or filters.get("max_date")))
+        if cacheable:
+            cached = await self._cache_get(b"brave:search:", request_key, self._search_cache)
+            if cached is not None:
+                logger.info("Search cache hit for query: %s", query)
+                return cached
+
         try:
-            # Calculate offset for pagination
-            offset = (page - 1) * per_page
-
-            # Prepare search parameters
-            params = {
-                "q": query,
-                "offset": offset,
-                "limit": per_page,
-                "search_lang": "en",
-                "safesearch": "moderate"
-            }
-
-            # Add additional filters if provided
-            if filters:
-                if filters.get("min_date"):
-                    params["since"] = filters["min_date"]
-                if filters.get("max_date"):
-                    params["until"] = filters["max_date"]
-                if filters.get("language"):
-                    params["search_lang"] = filters["language"][0]
-
-            logger.info(f"Making search request to Brave Search API with params: {params}")
-            
-            # Make the API request with retry logic
-            async with httpx.AsyncClient() as client:
-                data = await self._make_request(client, self.base_url, params)
-                
-                logger.info(f"Received {len(data.get('web', {}).get('results', []))} results")
-
-            # Transform the results to match our application's format
-            results = []
-            for item in data.get("web", {}).get("results", []):
-                result = {
-                    "url": item.get("url"),
-                    "title": item.get("title"),
-                    "snippet": item.get("description"),
-                    "score": item.get("score", 0),
-                    "domain": item.get("url", "").split("/")[2] if item.get("url") else "",
-                    "language": item.get("language", "en"),
-                    "metadata": {
-                        "published_date": item.get("published_date"),
-                        "age": item.get("age"),
-                        "type": item.get("type", "web")
-                    },
-                    "last_updated": item.get("published_date", "")
-                }
-                results.append(result)
-
-            return {
-                "results": results,
-                "total": data.get("web", {}).get("total", 0),
-                "page": page,
-                "per_page": per_page,
-                "total_pages": (data.get("web", {}).get("total", 0) + per_page - 1) // per_page
-            }
-
-        except httpx.HTTPError as e:
+            return await self._single_flight(
+                b"search:" + request_key,
+                lambda: self._fetch_search(query, page, per_page, filters, request_key if cacheable else None)
+            )
+        except aiohttp.ClientError as e:
             error_msg = f"HTTP error during search: {str(e)}"
             logger.error(error_msg)
             raise Exception(error_msg)
@@ -165,18 +407,121 @@ class BraveSearchService:
             logger.error(error_msg)
             raise Exception(error_msg)
 
+    async def _fetch_search(
+        self,
+        query: str,
+        page: int,
+        per_page: int,
+        filters: Optional[Dict[str, Any]],
+        cache_key: Optional[bytes]
+    ) -> Dict[str, Any]:
+        """Fetch and transform one page of results from Brave, caching it under `cache_key`."""
+        # Calculate offset for pagination
+        offset = (page - 1) * per_page
+
+        # Prepare search parameters
+        params = {
+            "q": query,
+            "offset": offset,
+            "limit": per_page,
+            "search_lang": "en",
+            "safesearch": "moderate"
+        }
+
+        # Add additional filters if provided
+        if filters:
+            if filters.get("min_date"):
+                params["since"] = filters["min_date"]
+            if filters.get("max_date"):
+                params["until"] = filters["max_date"]
+            if filters.get("language"):
+                params["search_lang"] = filters["language"][0]
+
+        logger.info("Making search request to Brave Search API with params: %s", params)
+        
+        # Make the API request with retry logic
+        data = await self._make_request(self.base_url, params)
+        
+        web = data.get("web", {})
+        results = [_transform_result(item) for item in web.get("results", ())]
+        logger.info("Received %d results", len(results))
+
+        total = web.get("total", 0)
+        response = {
+            "results": results,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "total_pages": (total + per_page - 1) // per_page
+        }
+
+        if cache_key is not None:
+            await self._cache_set(b"brave:search:", cache_key, response, self._search_cache, SEARCH_CACHE_TTL)
+        return response
+
+    async def _prefix_cached_suggestions(self, prefix: str) -> Optional[List[str]]:
+        """
+        Answer a suggestion lookup from the cached entry of a shorter prefix,
+        if that entry still holds enough suggestions starting with `prefix`.
+        """
+        shorter = [prefix[:i].encode() for i in range(len(prefix) - 1, 1, -1)]
+        if not shorter:
+            return None
+
+        if self.redis is None:
+            candidates = [self._suggest_cache.get(key) for key in shorter]
+        else:
+            try:
+                raw = await self.redis.mget([b"brave:suggest:" + key for key in shorter])
+            except RedisError as e:
+                logger.warning("Cache read failed, falling back to upstream: %s", e)
+                return None
+            candidates = (orjson.loads(item) if item is not None else None for item in raw)
+
+        # Longest prefix first: its suggestions are the most specific
+        for cached in candidates:
+            if not cached:
+                continue
+            matches = [s for s in cached if s.lower().startswith(prefix)]
+            if len(matches) >= SUGGEST_PREFIX_MIN_MATCHES:
+                return matches
+        return None
+
     async def get_suggestions(self, query: str) -> List[str]:
         """
         Get search suggestions from Brave Search API with rate limiting and retry logic.
+        Typeahead lookups are served from the cache of a shorter prefix when possible.
         """
+        query = query.strip()
+        if not is_valid_query(query, min_length=2):
+            return []
+
+        normalized = query.lower()
+        cache_key = normalized.encode()
+        cached = await self._cache_get(b"brave:suggest:", cache_key, self._suggest_cache)
+        if cached is not None:
+            return cached
+
+        cached = await self._prefix_cached_suggestions(normalized)
+        if cached is not None:
+            logger.info("Suggestions for '%s' served from a cached prefix", query)
+            return cached
+
         try:
-            async with httpx.AsyncClient() as client:
-                data = await self._make_request(
-                    client,
-                    "https://api.search.brave.com/res/v1/suggest",
-                    {"q": query}
-                )
-                return data.get("suggestions", [])
+            return await self._single_flight(
+                b"suggest:" + cache_key,
+                lambda: self._fetch_suggestions(query, cache_key)
+            )
         except Exception as e:
-            logger.error(f"Error getting suggestions: {str(e)}")
-            return [] 
\ No newline at end of file
+            logger.error("Error getting suggestions: %s", e)
+            return []
+
+    async def _fetch_suggestions(self, query: str, cache_key: bytes) -> List[str]:
+        """Fetch suggestions from Brave and cache them under `cache_key`."""
+        data = await self._make_request(
+            "https://api.search.brave.com/res/v1/suggest",
+            {"q": query}
+        )
+        suggestions = data.get("suggestions", [])
+        await self._cache_set(b"brave:suggest:", cache_key, suggestions, self._suggest_cache, SUGGEST_CACHE_TTL)
+        return suggestions 
\ No newline at end of file
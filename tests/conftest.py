@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Add the repository root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import fakeredis
+
+from search_service import RateLimiter, RedisRateLimiter
+
+
+def _redis_limiter(redis, capacity=2, rate=20.0):
+    return RedisRateLimiter(redis, fallback=RateLimiter(capacity=capacity, rate=rate))
+
+
+def test_redis_bucket_admits_burst_then_waits():
+    async def run():
+        limiter = _redis_limiter(fakeredis.FakeAsyncRedis())
+        await limiter.acquire()
+        await limiter.acquire()
+        return await limiter._run(0)
+
+    # Burst of two is admitted; the third token is ~1/rate = 50 ms away
+    assert 0 < asyncio.run(run()) <= 50
+
+
+def test_redis_bucket_is_shared_between_limiters():
+    async def run():
+        redis = fakeredis.FakeAsyncRedis()
+        first, second = _redis_limiter(redis), _redis_limiter(redis)
+        await first.acquire()
+        await first.acquire()
+        return await second._run(0)
+
+    assert asyncio.run(run()) > 0
+
+
+def test_redis_pause_delays_next_acquire():
+    async def run():
+        limiter = _redis_limiter(fakeredis.FakeAsyncRedis())
+        await limiter.pause(0.2)
+        start = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.15
+
+
+def test_redis_long_pause_outlives_default_expiry():
+    async def run():
+        redis = fakeredis.FakeAsyncRedis()
+        limiter = _redis_limiter(redis, capacity=1, rate=0.8)
+        await limiter.pause(300)
+        return await redis.pttl(limiter.key), await limiter._run(0)
+
+    ttl_ms, wait_ms = asyncio.run(run())
+    assert ttl_ms > 300_000
+    assert 299_000 < wait_ms <= 300_000
+
+
+def test_redis_limiter_falls_back_to_local_bucket():
+    async def run():
+        server = fakeredis.FakeServer()
+        server.connected = False
+        fallback = RateLimiter(capacity=1, rate=20.0)
+        limiter = RedisRateLimiter(fakeredis.FakeAsyncRedis(server=server), fallback=fallback)
+        await limiter.acquire()
+        await limiter.pause(5)
+        return fallback.tokens
+
+    assert asyncio.run(run()) <= 1 - 5 * 20.0
+
+
+def test_local_pause_delays_next_acquire():
+    async def run():
+        limiter = RateLimiter(capacity=3, rate=20.0)
+        await limiter.pause(0.2)
+        start = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.15
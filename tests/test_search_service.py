@@ -0,0 +1,51 @@
+import asyncio
+import os
+import re
+import time
+from email.utils import formatdate
+
+import aiohttp
+import pytest
+from aioresponses import aioresponses
+
+os.environ.setdefault("BRAVE_SEARCH_API_KEY", "test-key")
+
+from search_service import BraveSearchService, RateLimiter, _parse_retry_after
+
+BRAVE_URL = re.compile(r"^https://api\.search\.brave\.com/.*$")
+
+
+def test_parse_retry_after_seconds():
+    assert _parse_retry_after("3") == 3.0
+    assert _parse_retry_after("0.5") == 0.5
+    assert _parse_retry_after("-2") == 0.0
+
+
+def test_parse_retry_after_http_date():
+    wait = _parse_retry_after(formatdate(time.time() + 120, usegmt=True))
+    assert 115 <= wait <= 120
+
+
+def test_parse_retry_after_invalid():
+    assert _parse_retry_after(None) is None
+    assert _parse_retry_after("") is None
+    assert _parse_retry_after("soon") is None
+
+
+def test_long_retry_after_fails_fast_and_pauses_limiter():
+    async def run():
+        service = BraveSearchService()
+        service.rate_limiter = RateLimiter(capacity=1, rate=20.0)
+        async with aiohttp.ClientSession() as session:
+            service.client = session
+            with aioresponses() as mocked:
+                mocked.get(BRAVE_URL, status=429, headers={"Retry-After": "3600"})
+                start = time.monotonic()
+                with pytest.raises(aiohttp.ClientResponseError) as error:
+                    await service._make_request("https://api.search.brave.com/res/v1/web/search", {"q": "x"})
+                return error.value.status, time.monotonic() - start, service.rate_limiter.tokens
+
+    status, elapsed, tokens = asyncio.run(run())
+    assert status == 429
+    assert elapsed < 5
+    assert tokens <= 1 - 3600 * 20.0